@@ -2,9 +2,22 @@
 
 import json
 import logging
+import re
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime, timezone
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to stdlib json; other modules import it from here
+    orjson = None
+
+# Integer literals this long may not fit 64 bits; orjson silently reads those as floats
+_BIG_INT_RE = re.compile(rb'(?<![\d.])\d{19,}(?![\d.eE])')
+
+class JSONConstant(float):
+    """NaN/Infinity read from input; orjson refuses to encode it, so writers use stdlib json."""
 
 # Configuration
 INPUT_DIR = Path("input")
@@ -29,6 +42,16 @@ def load_json(path: Path) -> Dict[str, Any]:
         logger.error(f"JSON file not found: {path}")
         return {}
     try:
+        if orjson:
+            raw = path.read_bytes()
+            # Oversized ints would come back as lossy floats; keep them exact
+            if not _BIG_INT_RE.search(raw):
+                try:
+                    return orjson.loads(raw)
+                except orjson.JSONDecodeError:
+                    # NaN/Infinity literals: let the stdlib parser decide
+                    pass
+            return json.loads(raw.decode('utf-8'), parse_constant=JSONConstant)
         with open(path, 'r', encoding='utf-8') as f:
             return json.load(f)
     except Exception as e:
@@ -46,7 +69,36 @@ def format_timestamp(timestamp_ms: int) -> str:
     dt = datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc)
     return dt.isoformat().replace('+00:00', 'Z')
 
+def parse_created(created: Any) -> Optional[int]:
+    """Parse a "YYYY-MM-DD HH:MM:SS[ UTC]" Created string to epoch ms, or None."""
+    # Exports can carry null or non-string Created values
+    if not isinstance(created, str):
+        return None
+    return _parse_created(created)
+
+@lru_cache(maxsize=65536)
+def _parse_created(created: str) -> Optional[int]:
+    """Cached parse behind parse_created."""
+    if created.endswith(" UTC"):
+        created = created[:-4]
+    try:
+        # Fixed-width fast path; strptime handles anything else
+        if (len(created) == 19 and created[4] == '-' and created[7] == '-' and created[10] == ' '
+                and created[13] == ':' and created[16] == ':'
+                and (created[0:4] + created[5:7] + created[8:10]
+                     + created[11:13] + created[14:16] + created[17:19]).isdigit()):
+            dt = datetime(int(created[0:4]), int(created[5:7]), int(created[8:10]),
+                          int(created[11:13]), int(created[14:16]), int(created[17:19]),
+                          tzinfo=timezone.utc)
+        else:
+            dt = datetime.strptime(created, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return int(dt.timestamp() * 1000)
+
+# Characters not allowed in filenames, deleted by str.translate
+_INVALID_FILENAME_CHARS = str.maketrans("", "", '\\/*?:"<>|')
+
 def sanitize_filename(filename: str) -> str:
     """Remove invalid characters from filename."""
-    import re
-    return re.sub(r'[\\/*?:"<>|]', "", filename)[:255]
\ No newline at end of file
+    return filename.translate(_INVALID_FILENAME_CHARS)[:255]
\ No newline at end of file
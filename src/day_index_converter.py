@@ -4,45 +4,294 @@
 import json
 import hashlib
 import logging
+import mmap
+import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime, timezone
 from collections import defaultdict
-from typing import Dict, List, Any, Optional
+from functools import lru_cache
+from json.encoder import encode_basestring
+from operator import itemgetter, le
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+try:
+    import blake3
+except ImportError:  # optional, only SHA-1 pool names are available without it
+    blake3 = None
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; reflinks fall back to copying
+    fcntl = None
+
+from config import orjson, parse_created
 
 logger = logging.getLogger(__name__)
 
+# Process pools for hashing/copying media and writing day files
+POOL_WORKERS = os.cpu_count() or 1
+POOL_CHUNKSIZE = 32
+WRITE_CHUNKSIZE = 16
+# Below this many tasks a process pool costs more than it saves
+POOL_MIN_PARALLEL = 64
+
+def write_bytes(data: bytes, path: Path) -> None:
+    """Write a pre-encoded blob with a single open/write/close."""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    try:
+        fd = os.open(path, flags, 0o666)
+    except FileNotFoundError:
+        # Parent directories are usually created up front; only mkdir on a miss
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, flags, 0o666)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
 def write_json(data: Any, path: Path) -> None:
     """Write JSON with consistent formatting."""
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False, sort_keys=True)
+    encoded = None
+    if orjson:
+        # Same layout as the json.dumps call below
+        try:
+            encoded = orjson.dumps(
+                data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+            )
+        except orjson.JSONEncodeError:
+            # Ints past 64 bits or NaN/Infinity from the input; stdlib writes them as-is
+            pass
+    if encoded is None:
+        encoded = json.dumps(data, indent=2, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    write_bytes(encoded, path)
+
+# Keys of every messages.json row, as built in convert_from_memory
+MESSAGE_KEYS = frozenset((
+    "from", "id", "is_sender", "kind", "media", "media_type", "saved", "text", "timestamp", "timestamp_iso"
+))
+_encode_value = json.JSONEncoder(ensure_ascii=False).encode
+
+def _encode_scalar(value: Any) -> str:
+    """JSON-encode a scalar input value, short-cutting the common types."""
+    if value.__class__ is str:
+        return encode_basestring(value)
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    return _encode_value(value)
+
+def encode_messages(messages: List[Dict]) -> Optional[str]:
+    """Encode message rows exactly as write_json lays them out, with the keys hardcoded.
+    
+    Returns None if a row doesn't match MESSAGE_KEYS or holds nested input values.
+    """
+    enc = _encode_scalar
+    enc_str = encode_basestring
+    rows = []
+    for msg in messages:
+        if msg.keys() != MESSAGE_KEYS:
+            return None
+        sender, media_type, text = msg["from"], msg["media_type"], msg["text"]
+        if isinstance(sender, (dict, list)) or isinstance(media_type, (dict, list)) or isinstance(text, (dict, list)):
+            return None
+        
+        media = msg["media"]
+        media_json = "[\n      " + ",\n      ".join(map(enc_str, media)) + "\n    ]" if media else "[]"
+        # id, kind, timestamp_iso and media are built as str, the flags as bool
+        rows.append(
+            f'  {{\n'
+            f'    "from": {enc(sender)},\n'
+            f'    "id": {enc_str(msg["id"])},\n'
+            f'    "is_sender": {"true" if msg["is_sender"] else "false"},\n'
+            f'    "kind": {enc_str(msg["kind"])},\n'
+            f'    "media": {media_json},\n'
+            f'    "media_type": {enc(media_type)},\n'
+            f'    "saved": {"true" if msg["saved"] else "false"},\n'
+            f'    "text": {enc(text)},\n'
+            f'    "timestamp": {msg["timestamp"]},\n'
+            f'    "timestamp_iso": {enc_str(msg["timestamp_iso"])}\n'
+            f'  }}'
+        )
+    return "[\n" + ",\n".join(rows) + "\n]" if rows else "[]"
+
+def write_messages_json(messages: List[Dict], path: Path) -> None:
+    """Write messages.json; without orjson, use the fixed-schema encoder."""
+    encoded = None if orjson else encode_messages(messages)
+    if encoded is None:
+        write_json(messages, path)
+        return
+    
+    write_bytes(encoded.encode('utf-8'), path)
+
+MS_PER_DAY = 86_400_000
+# "HH:MM:" for each minute of the day and "SS" for each second
+_HH_MM = [f"{h:02d}:{m:02d}:" for h in range(24) for m in range(60)]
+_SS = [f"{s:02d}" for s in range(60)]
+
+@lru_cache(maxsize=4096)
+def day_key_from_days(days: int) -> str:
+    """Return "YYYY-MM-DD" for a day count since the epoch (civil-from-days)."""
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    d = doy - (153 * mp + 2) // 5 + 1
+    m = mp + 3 if mp < 10 else mp - 9
+    y = yoe + era * 400 + (m <= 2)
+    return f"{y:04d}-{m:02d}-{d:02d}"
+
+def iso_from_ms(t_ms: int) -> str:
+    """Format epoch ms like datetime.isoformat(), with a Z suffix."""
+    days, ms_of_day = divmod(t_ms, MS_PER_DAY)
+    secs, ms = divmod(ms_of_day, 1000)
+    minutes, secs = divmod(secs, 60)
+    base = f"{day_key_from_days(days)}T{_HH_MM[minutes]}{_SS[secs]}"
+    return f"{base}.{ms:03d}000Z" if ms else base + "Z"
+
+def _write_one(item: Tuple[Callable[[Any, Path], None], Path, Any]) -> None:
+    """Pool worker: write one (writer, path, data) JSON file."""
+    writer, path, data = item
+    writer(data, path)
+
+def write_json_batch(items: List[Tuple[Callable[[Any, Path], None], Path, Any]]) -> None:
+    """Write many JSON files, spread across processes when there are enough."""
+    if len(items) >= POOL_MIN_PARALLEL and POOL_WORKERS > 1:
+        with ProcessPoolExecutor(max_workers=POOL_WORKERS) as executor:
+            list(executor.map(_write_one, items, chunksize=WRITE_CHUNKSIZE))
+    else:
+        for item in items:
+            _write_one(item)
 
-def parse_timestamp(msg: Dict) -> tuple[int, str, bool]:
-    """Parse message timestamp. Returns (ms, iso_string, is_sender)."""
+def parse_timestamp(msg: Dict) -> Tuple[int, str]:
+    """Parse message timestamp. Returns (ms, iso_string)."""
     # Try milliseconds field first
     t_ms = msg.get("Created(microseconds)")
     if t_ms:
         t_ms = int(t_ms)
     else:
         # Parse from Created string
-        created = msg.get("Created", "")
-        if created.endswith(" UTC"):
-            created = created[:-4]
-        try:
-            dt = datetime.strptime(created, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
-            t_ms = int(dt.timestamp() * 1000)
-        except:
+        t_ms = parse_created(msg.get("Created", ""))
+        if t_ms is None:
             t_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
     
     # Convert to ISO format
-    t_iso = datetime.fromtimestamp(t_ms/1000, tz=timezone.utc).isoformat().replace("+00:00", "Z")
-    is_sender = bool(msg.get("IsSender"))
+    return t_ms, iso_from_ms(t_ms)
+
+def parse_timestamps(messages: List[Dict]) -> List[Tuple[int, str]]:
+    """Parse a conversation's timestamps in one pass. Returns (ms, iso_string) per message."""
+    timestamps = []
+    for msg in messages:
+        # Exports normally carry the numeric field; the rest take the full parse
+        raw = msg.get("Created(microseconds)")
+        if raw:
+            t_ms = int(raw)
+            timestamps.append((t_ms, iso_from_ms(t_ms)))
+        else:
+            timestamps.append(parse_timestamp(msg))
+    return timestamps
+
+HASH_CHUNK_SIZE = 1 << 20
+# Smaller files are read directly; mapping them costs more than it saves
+MMAP_MIN_SIZE = 65536
+
+def sha1_of_file(path: Path) -> str:
+    """Return the SHA-1 hex digest of a file."""
+    with open(path, 'rb', buffering=0) as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_MIN_SIZE:
+            # One update over the whole mapping; the kernel pages it in
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                return hashlib.sha1(mm).hexdigest()
+        
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha1").hexdigest()
+        
+        h = hashlib.sha1()
+        buf = bytearray(HASH_CHUNK_SIZE)
+        view = memoryview(buf)
+        while n := f.readinto(buf):
+            h.update(view[:n])
+        return h.hexdigest()
+
+# Content hashes for pool filenames; SHA-1 keeps names from earlier runs stable
+HASH_ALGOS = ("sha1", "blake3") if blake3 else ("sha1",)
+
+def hash_file(path: Path, hash_algo: str = "sha1") -> str:
+    """Return the hex digest of a file for the given pool hash algorithm."""
+    if hash_algo == "blake3":
+        h = blake3.blake3(max_threads=blake3.blake3.AUTO)
+        h.update_mmap(path)
+        return h.hexdigest()
+    return sha1_of_file(path)
+
+POOL_INDEX_NAME = ".pool_index.json"
+
+def load_pool_index(path: Path) -> Dict[str, str]:
+    """Load the source -> pool filename index from a previous run."""
+    try:
+        if orjson:
+            return orjson.loads(path.read_bytes())
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# How pool files are materialized: hardlink, copy-on-write clone, or byte copy
+COPY_MODES = ("link", "reflink", "copy")
+FICLONE = 0x40049409  # Linux ioctl; btrfs, XFS
+
+def _reflink(src: Path, dest: Path) -> bool:
+    """Clone src to dest sharing extents; False if unsupported."""
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return True
+            except OSError:
+                pass
+        
+        # In-kernel copy; clones on filesystems that support it
+        if not hasattr(os, "copy_file_range"):
+            return False
+        try:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if n == 0:
+                    break
+                remaining -= n
+        except OSError:
+            return False
+    return remaining == 0
+
+def place_file(src: Path, dest: Path, copy_mode: str = "link") -> None:
+    """Materialize src at dest by hardlink, reflink or copy, falling back in that order."""
+    if copy_mode == "link":
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            pass
+    
+    if copy_mode in ("link", "reflink") and _reflink(src, dest):
+        shutil.copystat(src, dest)
+        return
     
-    return t_ms, t_iso, is_sender
+    shutil.copy2(src, dest)
 
-def copy_media_to_pool(src: Path, pool_dir: Path, use_hash: bool = True) -> Optional[str]:
-    """Copy media file to pool directory."""
+def copy_media_to_pool(src: Path, pool_dir: Path, use_hash: bool = True,
+                       copy_mode: str = "link", hash_algo: str = "sha1") -> Optional[str]:
+    """Copy media file to pool directory. Returns its pool filename."""
     if not src.is_file():
         return None
     
@@ -50,24 +299,28 @@ def copy_media_to_pool(src: Path, pool_dir: Path, use_hash: bool = True) -> Opti
     
     if use_hash:
         # Hash-based filename for deduplication
-        h = hashlib.sha1()
-        with open(src, 'rb') as f:
-            while chunk := f.read(8192):
-                h.update(chunk)
-        filename = h.hexdigest() + src.suffix.lower()
+        filename = hash_file(src, hash_algo) + src.suffix.lower()
     else:
         filename = src.name
     
     dest = pool_dir / filename
     if not dest.exists():
-        shutil.copy2(src, dest)
+        # Place under a private name and rename, so a worker copying the same
+        # content never sees a partial file
+        tmp = pool_dir / f".{filename}.{os.getpid()}.tmp"
+        place_file(src, tmp, copy_mode)
+        os.replace(tmp, dest)
     
-    return f"/m/{filename}"
+    return filename
 
-def process_media_files(media_locations: List[str], temp_dir: Path, pool_dir: Path, 
-                       use_hash: bool = True) -> List[str]:
-    """Process media files and return pool paths."""
-    pool_paths = []
+def hash_and_copy(task: Tuple[str, str, bool, str, str]) -> Tuple[str, Optional[str]]:
+    """Pool worker: copy one file into the pool. Returns (src, pool filename)."""
+    src, pool_dir, use_hash, copy_mode, hash_algo = task
+    return src, copy_media_to_pool(Path(src), Path(pool_dir), use_hash, copy_mode, hash_algo)
+
+def collect_media_files(media_locations: List[str], temp_dir: Path) -> List[Path]:
+    """Expand mapped media locations into the files they refer to."""
+    files = []
     
     for location in media_locations:
         path = temp_dir / location
@@ -75,14 +328,69 @@ def process_media_files(media_locations: List[str], temp_dir: Path, pool_dir: Pa
         # Handle grouped folders
         if location.endswith(("_multipart", "_grouped")):
             if path.is_dir():
-                for child in sorted(path.iterdir()):
+                with os.scandir(path) as it:
+                    children = sorted(it, key=lambda entry: entry.name)
+                for child in children:
                     if child.is_file() and child.name != "timestamps.json":
-                        if pool_path := copy_media_to_pool(child, pool_dir, use_hash):
-                            pool_paths.append(pool_path)
+                        files.append(Path(child.path))
         # Handle regular files
         elif path.is_file():
-            if pool_path := copy_media_to_pool(path, pool_dir, use_hash):
-                pool_paths.append(pool_path)
+            files.append(path)
+    
+    return files
+
+def pool_media_files(sources: List[Path], pool_dir: Path, use_hash: bool = True,
+                     pool_index: Optional[Dict[str, str]] = None,
+                     copy_mode: str = "link", hash_algo: str = "sha1") -> Dict[Path, str]:
+    """Hash and copy files into the pool across processes. Returns source -> pool path.
+    
+    pool_index maps "algo|path|size|mtime_ns" to a pool filename so unchanged
+    sources skip hashing on reruns. It is rewritten to hold only this run's sources.
+    """
+    pool_dir.mkdir(parents=True, exist_ok=True)
+    
+    pool_paths = {}
+    index_keys = {}
+    live_index = {}
+    seen_names = set()
+    tasks = []
+    
+    for src in dict.fromkeys(sources):
+        if use_hash:
+            if pool_index is not None:
+                st = src.stat()
+                key = f"{hash_algo}|{src.absolute()}|{st.st_size}|{st.st_mtime_ns}"
+                filename = pool_index.get(key)
+                if filename and (pool_dir / filename).exists():
+                    pool_paths[src] = f"/m/{filename}"
+                    live_index[key] = filename
+                    continue
+                index_keys[str(src)] = key
+        elif src.name in seen_names:
+            # Unhashed names collide; the first source keeps the pool file
+            pool_paths[src] = f"/m/{src.name}"
+            continue
+        else:
+            seen_names.add(src.name)
+        
+        tasks.append((str(src), str(pool_dir), use_hash, copy_mode, hash_algo))
+    
+    if len(tasks) >= POOL_MIN_PARALLEL and POOL_WORKERS > 1:
+        with ProcessPoolExecutor(max_workers=POOL_WORKERS) as executor:
+            results = list(executor.map(hash_and_copy, tasks, chunksize=POOL_CHUNKSIZE))
+    else:
+        results = [hash_and_copy(task) for task in tasks]
+    
+    for src, filename in results:
+        if filename:
+            pool_paths[Path(src)] = f"/m/{filename}"
+            if src in index_keys:
+                live_index[index_keys[src]] = filename
+    
+    # Drop keys from earlier runs so the index doesn't grow without bound
+    if pool_index is not None:
+        pool_index.clear()
+        pool_index.update(live_index)
     
     return pool_paths
 
@@ -93,7 +401,9 @@ def convert_from_memory(conversations: Dict[str, List],
                        temp_media_dir: Path,
                        output_dir: Path,
                        use_hash: bool = True,
-                       avatars: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+                       avatars: Optional[Dict[str, str]] = None,
+                       copy_mode: str = "link",
+                       hash_algo: str = "sha1") -> Dict[str, Any]:
     """Convert conversations to simplified day-index format."""
     
     # Setup directories
@@ -109,6 +419,10 @@ def convert_from_memory(conversations: Dict[str, List],
     # Track statistics
     stats = defaultdict(int)
     
+    # Pool filenames from earlier runs (only kept when output isn't cleaned)
+    pool_index_path = output_dir / POOL_INDEX_NAME
+    pool_index = load_pool_index(pool_index_path) if use_hash else None
+    
     # Process avatars first
     avatar_paths = {}
     if avatars:
@@ -125,7 +439,8 @@ def convert_from_memory(conversations: Dict[str, List],
     
     # Group messages by day
     day_data = defaultdict(lambda: defaultdict(list))
-    mapped_media = set()
+    # (message, source files); pooled in one batch with the orphans
+    message_media = []
     
     logger.info("Processing conversations...")
     
@@ -133,10 +448,7 @@ def convert_from_memory(conversations: Dict[str, List],
         if not messages:
             continue
         
-        # Determine conversation type
-        is_group = any(msg.get("Conversation Title") for msg in messages)
-        
-        # Get participants
+        # Get participants and the group title in one pass
         participants = set()
         group_title = None
         
@@ -149,6 +461,9 @@ def convert_from_memory(conversations: Dict[str, List],
             if title := msg.get("Conversation Title"):
                 group_title = title
         
+        # Any titled message makes this a group conversation
+        is_group = group_title is not None
+        
         # Add conversation ID for individual chats
         if not is_group:
             participants.add(conv_id)
@@ -174,25 +489,29 @@ def convert_from_memory(conversations: Dict[str, List],
             user_conversations[user].add(conv_id)
         
         # Process messages by day
+        timestamps = parse_timestamps(messages)
+        conv_mappings = mappings.get(conv_id)
+        # Consecutive messages mostly share a day; per-day work only runs when it changes
+        current_date = None
+        day_messages = None
         for msg_idx, msg in enumerate(messages):
-            t_ms, t_iso, is_sender = parse_timestamp(msg)
+            t_ms, t_iso = timestamps[msg_idx]
             
-            # Update date range
-            date_str = t_iso.split("T")[0]
-            if not date_range["start"] or date_str < date_range["start"]:
-                date_range["start"] = date_str
-            if not date_range["end"] or date_str > date_range["end"]:
-                date_range["end"] = date_str
+            date_str = t_iso[:10]
+            if date_str != current_date:
+                current_date = date_str
+                day_messages = day_data[date_str][conv_id]
+                
+                # Update date range
+                if not date_range["start"] or date_str < date_range["start"]:
+                    date_range["start"] = date_str
+                if not date_range["end"] or date_str > date_range["end"]:
+                    date_range["end"] = date_str
             
             # Get media for this message
             media_files = []
-            if conv_id in mappings and msg_idx in mappings[conv_id]:
-                for item in mappings[conv_id][msg_idx]:
-                    media_files.append(item["filename"])
-                    mapped_media.add(item["filename"])
-            
-            # Process media to pool
-            pool_paths = process_media_files(media_files, temp_media_dir, pool_dir, use_hash)
+            if conv_mappings and msg_idx in conv_mappings:
+                media_files = [item.filename for item in conv_mappings[msg_idx]]
             
             # Store message data
             message_data = {
@@ -200,17 +519,21 @@ def convert_from_memory(conversations: Dict[str, List],
                 "timestamp": t_ms,
                 "timestamp_iso": t_iso,
                 "from": msg.get("From"),
-                "is_sender": is_sender,
+                "is_sender": bool(msg.get("IsSender")),
                 "kind": "snap" if msg.get("Type") == "snap" else "chat",
                 "media_type": msg.get("Media Type"),
                 "text": msg.get("Content"),
                 "saved": bool(msg.get("IsSaved")),
-                "media": pool_paths
+                "media": []
             }
             
-            day_data[date_str][conv_id].append(message_data)
-            stats['total_events'] += 1
-            stats['total_media'] += len(pool_paths)
+            day_messages.append(message_data)
+            
+            if media_files:
+                if sources := collect_media_files(media_files, temp_media_dir):
+                    message_media.append((message_data, sources))
+        
+        stats['total_events'] += len(messages)
     
     # Build user index with avatars and display names - only for users in conversations
     for username in user_conversations.keys():
@@ -233,9 +556,21 @@ def convert_from_memory(conversations: Dict[str, List],
     
     # Process orphaned media
     logger.info("Processing orphaned media...")
-    orphaned_by_day = defaultdict(list)
+    # Every mapped location, derived once from the mappings
+    mapped_media = {
+        item.filename
+        for conv_mappings in mappings.values()
+        for items in conv_mappings.values()
+        for item in items
+    }
+    # (source file, target date) in scan order
+    orphan_files = []
     
-    for item in temp_media_dir.iterdir():
+    with os.scandir(temp_media_dir) as it:
+        entries = list(it)
+    
+    # DirEntry caches the file type from the directory read
+    for item in entries:
         # Skip mapped files, thumbnails, and overlays
         if item.name in mapped_media or "thumbnail" in item.name.lower() or "_overlay~" in item.name:
             continue
@@ -251,46 +586,51 @@ def convert_from_memory(conversations: Dict[str, List],
             except ValueError:
                 pass
         
-        # Copy orphaned media to pool
         if item.is_file():
-            if pool_path := copy_media_to_pool(item, pool_dir, use_hash):
-                # Use extracted date or fall back to first day
-                target_date = date_str if date_str else date_range["start"]
-                if target_date:
-                    orphaned_by_day[target_date].append(pool_path)
-                    stats['orphaned_media'] += 1
+            # Use extracted date or fall back to first day
+            orphan_files.append((Path(item.path), date_str if date_str else date_range["start"]))
         elif item.is_dir() and item.name.endswith(("_multipart", "_grouped")):
-            # Extract date from folder name
-            folder_date = None
-            if item.name[:10].count('-') == 2:
-                try:
-                    potential_date = item.name[:10]
-                    datetime.strptime(potential_date, "%Y-%m-%d")
-                    folder_date = potential_date
-                except ValueError:
-                    pass
+            # Date from folder name, already extracted above
+            folder_date = date_str
+            
+            with os.scandir(item.path) as children:
+                folder_entries = list(children)
             
-            for child in item.iterdir():
+            for child in folder_entries:
                 if child.is_file() and child.name != "timestamps.json":
-                    if pool_path := copy_media_to_pool(child, pool_dir, use_hash):
-                        # Try to get date from child filename first, then folder, then fallback
-                        child_date = None
-                        if child.name[:10].count('-') == 2:
-                            try:
-                                potential_date = child.name[:10]
-                                datetime.strptime(potential_date, "%Y-%m-%d")
-                                child_date = potential_date
-                            except ValueError:
-                                pass
-                        
-                        target_date = child_date or folder_date or date_range["start"]
-                        if target_date:
-                            orphaned_by_day[target_date].append(pool_path)
-                            stats['orphaned_media'] += 1
+                    # Try to get date from child filename first, then folder, then fallback
+                    child_date = None
+                    if child.name[:10].count('-') == 2:
+                        try:
+                            potential_date = child.name[:10]
+                            datetime.strptime(potential_date, "%Y-%m-%d")
+                            child_date = potential_date
+                        except ValueError:
+                            pass
+                    
+                    orphan_files.append((Path(child.path), child_date or folder_date or date_range["start"]))
+    
+    # Hash and copy message and orphaned media into the pool in one batch
+    sources = [src for _, files in message_media for src in files]
+    sources.extend(src for src, _ in orphan_files)
+    pool_paths = pool_media_files(sources, pool_dir, use_hash, pool_index, copy_mode, hash_algo)
+    
+    for message_data, files in message_media:
+        message_data["media"] = [pool_paths[src] for src in files if src in pool_paths]
+        stats['total_media'] += len(message_data["media"])
+    
+    orphaned_by_day = defaultdict(list)
+    for src, target_date in orphan_files:
+        if target_date and src in pool_paths:
+            orphaned_by_day[target_date].append(pool_paths[src])
+            stats['orphaned_media'] += 1
     
     # Write day indexes and messages
     logger.info(f"Writing {len(day_data)} day indexes...")
     
+    # (writer, path, data) for every day file; encoded and written in one batch
+    json_files = []
+    
     for date_str in sorted(day_data.keys()):
         day_dir = days_dir / date_str
         day_dir.mkdir(exist_ok=True)
@@ -301,8 +641,11 @@ def convert_from_memory(conversations: Dict[str, List],
             if not messages:
                 continue
             
-            # Sort messages by timestamp
-            messages.sort(key=lambda m: m['timestamp'])
+            # Sort messages by timestamp; conversations arrive time-ordered,
+            # so this is usually a single pass over the int keys
+            times = [m['timestamp'] for m in messages]
+            if not all(map(le, times, times[1:])):
+                messages.sort(key=itemgetter('timestamp'))
             
             # Get latest message info
             latest = messages[-1]
@@ -334,20 +677,12 @@ def convert_from_memory(conversations: Dict[str, List],
             conv_dir = day_dir / f"messages-{conv_id}"
             conv_dir.mkdir(exist_ok=True)
             
-            # Prepare messages for output (keep media in both places)
-            output_messages = []
-            media_mappings = {}
+            # Media stays in each message and is also indexed by message id.
+            # Nothing mutates the messages, so they are written without copying.
+            media_mappings = {msg["id"]: msg["media"] for msg in messages if msg["media"]}
             
-            for msg in messages:
-                msg_copy = msg.copy()
-                media_files = msg_copy.get("media", [])  # Keep media in message
-                output_messages.append(msg_copy)
-                
-                if media_files:
-                    media_mappings[msg["id"]] = media_files
-            
-            write_json(output_messages, conv_dir / "messages.json")
-            write_json(media_mappings, conv_dir / "media_mappings.json")
+            json_files.append((write_messages_json, conv_dir / "messages.json", messages))
+            json_files.append((write_json, conv_dir / "media_mappings.json", media_mappings))
         
         # Write day index
         day_index = {
@@ -355,11 +690,16 @@ def convert_from_memory(conversations: Dict[str, List],
             "conversations": day_conversations,
             "orphaned_media": orphaned_by_day.get(date_str, [])
         }
-        write_json(day_index, day_dir / "index.json")
+        json_files.append((write_json, day_dir / "index.json", day_index))
         stats['total_days'] += 1
     
+    write_json_batch(json_files)
+    
     stats['total_conversations'] = len(all_conversations)
     
+    if pool_index is not None:
+        write_json(pool_index, pool_index_path)
+    
     logger.info(f"Conversion complete: {stats['total_events']} events, "
                 f"{stats['total_media']} media items, {stats['total_days']} days")
     
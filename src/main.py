@@ -3,6 +3,7 @@
 
 import argparse
 import logging
+import os
 import shutil
 import sys
 from pathlib import Path
@@ -29,7 +30,7 @@ from conversation import (
     collect_all_usernames
 )
 
-from day_index_converter import convert_from_memory
+from day_index_converter import COPY_MODES, HASH_ALGOS, convert_from_memory
 from bitmoji_processing import extract_bitmojis
 
 def find_export_folder(input_dir: Path) -> Path:
@@ -48,21 +49,27 @@ def copy_unmerged_files(source_dir: Path, temp_dir: Path, merged_files: Set[str]
     copied = 0
     skipped_overlays = 0
     
-    for item in source_dir.iterdir():
-        if not item.is_file():
-            continue
-        
-        # Skip merged files, thumbnails, and overlays
-        if item.name in merged_files:
-            continue
-        if "thumbnail" in item.name.lower():
-            continue
-        if "_overlay~" in item.name:
-            skipped_overlays += 1
-            continue
-        
-        shutil.copy(item, temp_dir / item.name)
-        copied += 1
+    with os.scandir(source_dir) as entries:
+        for item in entries:
+            if not item.is_file():
+                continue
+            
+            # Skip merged files, thumbnails, and overlays
+            name = item.name
+            if name in merged_files:
+                continue
+            if "thumbnail" in name.lower():
+                continue
+            if "_overlay~" in name:
+                skipped_overlays += 1
+                continue
+            
+            # Unlink first: a leftover copy may be hardlinked into the media pool.
+            # copy2 keeps the mtime so the pool index can match on reruns
+            dest = temp_dir / name
+            dest.unlink(missing_ok=True)
+            shutil.copy2(item.path, dest)
+            copied += 1
     
     logger.info(f"Copied {copied} unmerged files")
     if skipped_overlays:
@@ -83,6 +90,10 @@ def main():
     parser.add_argument("--log-level", default="INFO", help="Logging level")
     parser.add_argument("--no-hash", action="store_true", 
                        help="Keep original filenames in media pool (disables deduplication)")
+    parser.add_argument("--copy-mode", choices=COPY_MODES, default="link",
+                       help="How media enters the pool: hardlink, reflink (copy-on-write) or copy")
+    parser.add_argument("--hash-algo", choices=HASH_ALGOS, default="sha1",
+                       help="Content hash for pool filenames (blake3 needs the blake3 package)")
     args = parser.parse_args()
     
     # Setup logging
@@ -119,7 +130,11 @@ def main():
         
         # OVERLAY MERGING PHASE
         phase_start = time.time()
-        merged_files, merge_stats = merge_overlay_pairs(source_media_dir, temp_media_dir)
+        # Kept outside temp_media so it survives cleanup; reused with --no-clean
+        merged_files, merge_stats = merge_overlay_pairs(
+            source_media_dir, temp_media_dir,
+            hash_cache_path=args.output / ".overlay_hash_cache.json"
+        )
         all_stats['merge'] = merge_stats
         phase_times['overlay_merging'] = time.time() - phase_start
         
@@ -197,7 +212,9 @@ def main():
             temp_media_dir=temp_media_dir,
             output_dir=args.output,
             use_hash=not args.no_hash,
-            avatars=avatars
+            avatars=avatars,
+            copy_mode=args.copy_mode,
+            hash_algo=args.hash_algo
         )
         
         # Add converter stats to all_stats
@@ -1,28 +1,83 @@
 """Media processing: overlay merging, indexing, and mapping."""
 
+import calendar
+import atexit
 import hashlib
 import json
 import logging
+import mmap
 import os
 import re
 import shutil
 import struct
 import subprocess
-from collections import defaultdict
-from multiprocessing import Pool, cpu_count
+import sys
+from bisect import bisect_left
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import lru_cache
+from multiprocessing import cpu_count, get_context
 from pathlib import Path
 from typing import Dict, List, Optional, Set, Tuple, Any
 
+try:
+    import numpy as np
+except ImportError:  # optional, batch lookups fall back to bisect
+    np = None
+
+try:
+    import blake3
+except ImportError:  # optional, overlay hashing falls back to hashlib.blake2b
+    blake3 = None
+
+try:
+    from PIL import Image
+except ImportError:  # optional, blank-overlay detection is skipped without it
+    Image = None
+
 from config import (
     TIMESTAMP_THRESHOLD_SECONDS,
     QUICKTIME_EPOCH_ADJUSTER,
     ensure_directory,
-    format_timestamp
+    format_timestamp,
+    load_json,
+    orjson,
+    parse_created,
+    save_json
 )
-from datetime import datetime, timezone
+from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Filename patterns
+_THUMBNAIL_RE = re.compile(r'thumbnail', re.I)
+_B_RE = re.compile(r'b~([^.]+)', re.I)
+_ZIP_RE = re.compile(r'media~zip-([A-F0-9\-]+)', re.I)
+_MO_RE = re.compile(r'(media|overlay)~([A-F0-9\-]+)', re.I)
+# Date prefix plus media/overlay kind; thumbnails and zip stubs never match
+_CLASSIFY_RE = re.compile(
+    r'(?P<date>\d{4}-\d{2}-\d{2})(?!.*(?i:thumbnail)|.*media~zip-)'
+    r'(?:.*?(?P<media>_media~)|.*?_overlay~)',
+    re.S
+)
+
+# Threads for I/O-bound header and sidecar reads
+IO_WORKERS = 16
+
+# Concurrent single-pair FFmpeg merges
+MERGE_WORKERS = max(1, cpu_count() - 1)
+
+# Bytes of FFmpeg stderr kept for failure logs
+FFMPEG_STDERR_TAIL = 8192
+
+# FFmpeg merges run for seconds each, so hand them out one at a time
+FFMPEG_CHUNKSIZE = 1
+
+# Fork avoids re-importing this module in every FFmpeg pool worker (spawn);
+# macOS keeps its default since fork is unsafe with system frameworks there
+_MP_CONTEXT = get_context("fork") if os.name == "posix" and sys.platform != "darwin" else get_context()
+
 
 def parse_iso_timestamp(iso_str: str) -> datetime:
     """Parse ISO timestamp string to datetime object."""
@@ -32,36 +87,127 @@ def parse_iso_timestamp(iso_str: str) -> datetime:
 
 def iso_to_ms(iso_str: str) -> int:
     """Convert ISO timestamp string to milliseconds."""
+    # Fast path for the fixed-width "YYYY-MM-DDTHH:MM:SSZ" form written by format_timestamp
+    if len(iso_str) == 20 and iso_str[10] == 'T' and iso_str[19] == 'Z':
+        return calendar.timegm((
+            int(iso_str[0:4]), int(iso_str[5:7]), int(iso_str[8:10]),
+            int(iso_str[11:13]), int(iso_str[14:16]), int(iso_str[17:19]), 0, 0, 0
+        )) * 1000
     dt = parse_iso_timestamp(iso_str)
     return int(dt.timestamp() * 1000)
 
-def get_timestamp_diff_seconds(iso1: str, iso2: str) -> float:
-    """Calculate difference in seconds between two ISO timestamps."""
-    dt1 = parse_iso_timestamp(iso1)
-    dt2 = parse_iso_timestamp(iso2)
-    return abs((dt1 - dt2).total_seconds())
+def find_nearest_timestamp(sorted_ms: List[int], target_ms: int,
+                           max_diff_ms: Optional[int] = None) -> Tuple[int, float]:
+    """Find closest entry in a sorted millisecond list. Returns (index, diff_seconds), earliest wins ties.
+    
+    Index is -1 when the list is empty or the closest entry is further than max_diff_ms.
+    """
+    if not sorted_ms:
+        return -1, float('inf')
+    
+    # Nothing can be close enough outside the covered range
+    if max_diff_ms is not None and (target_ms < sorted_ms[0] - max_diff_ms
+                                    or target_ms > sorted_ms[-1] + max_diff_ms):
+        return -1, float('inf')
+    
+    idx = bisect_left(sorted_ms, target_ms)
+    best_idx = -1
+    best_diff = 0
+    
+    if idx > 0:
+        # First entry of the run sharing the preceding timestamp
+        best_idx = bisect_left(sorted_ms, sorted_ms[idx - 1], 0, idx - 1)
+        best_diff = target_ms - sorted_ms[idx - 1]
+    
+    if idx < len(sorted_ms) and (best_idx < 0 or sorted_ms[idx] - target_ms < best_diff):
+        best_idx = idx
+        best_diff = sorted_ms[idx] - target_ms
+    
+    if max_diff_ms is not None and best_diff > max_diff_ms:
+        return -1, best_diff / 1000
+    return best_idx, best_diff / 1000
+
+def find_nearest_timestamps(sorted_ms: List[int], targets_ms: List[int],
+                            max_diff_ms: Optional[int] = None) -> List[Tuple[int, float]]:
+    """find_nearest_timestamp for many targets at once, vectorized when NumPy is installed."""
+    if np is None or not sorted_ms or not targets_ms:
+        return [find_nearest_timestamp(sorted_ms, t, max_diff_ms) for t in targets_ms]
+    
+    ts = np.asarray(sorted_ms, dtype=np.int64)
+    targets = np.asarray(targets_ms, dtype=np.int64)
+    missing = np.iinfo(np.int64).max
+    
+    idx = np.searchsorted(ts, targets, side='left')
+    left = np.maximum(idx - 1, 0)
+    right = np.minimum(idx, len(ts) - 1)
+    left_diff = np.where(idx > 0, targets - ts[left], missing)
+    right_diff = np.where(idx < len(ts), ts[right] - targets, missing)
+    
+    # Same tie rule as the scalar version: earliest entry of the preceding run wins
+    use_right = right_diff < left_diff
+    best = np.where(use_right, right, np.searchsorted(ts, ts[left], side='left'))
+    diff = np.where(use_right, right_diff, left_diff)
+    if max_diff_ms is not None:
+        best = np.where(diff <= max_diff_ms, best, -1)
+    
+    return [(b, d / 1000) for b, d in zip(best.tolist(), diff.tolist())]
+
 
+def get_ffmpeg_threads(workers: int) -> int:
+    """Threads per FFmpeg process so `workers` concurrent merges roughly fill the CPU."""
+    override = os.environ.get("MERGER_FFMPEG_THREADS")
+    if override:
+        try:
+            return min(64, max(1, int(override)))
+        except ValueError:
+            logger.warning(f"Ignoring invalid MERGER_FFMPEG_THREADS={override!r}")
+    return max(1, cpu_count() // max(1, workers))
 
-def _ffmpeg_worker(args: Tuple[Path, Path, Path]) -> Optional[Tuple[str, Optional[str]]]:
+def _ffmpeg_worker(args: Tuple[str, str, str, int]) -> Optional[Tuple[str, Optional[str]]]:
     """
     A picklable top-level worker function for FFmpeg merging.
+    Takes plain path strings to keep task pickles small.
     On success, returns the original media filename and its extracted ISO timestamp.
     """
-    media_file, overlay_file, output_path = args
-    if run_ffmpeg_merge(media_file, overlay_file, output_path):
+    media_path, overlay_path, output_path, threads = args
+    media_file = Path(media_path)
+    if run_ffmpeg_merge(media_file, Path(overlay_path), Path(output_path), threads):
         timestamp = extract_mp4_timestamp(media_file)
         return (media_file.name, timestamp)
     return None
 
 
-def run_ffmpeg_merge(media_file: Path, overlay_file: Path, output_file: Path) -> bool:
-    """Merge media with overlay using FFmpeg."""
+@lru_cache(maxsize=1024)
+def is_blank_overlay(overlay_file: Path) -> bool:
+    """Check whether an overlay image is fully transparent."""
+    if Image is None:
+        return False
+    try:
+        with Image.open(overlay_file) as img:
+            return img.convert("RGBA").getchannel("A").getbbox() is None
+    except Exception:
+        return False
+
+def run_ffmpeg_merge(media_file: Path, overlay_file: Path, output_file: Path, threads: int = 0) -> bool:
+    """Merge media with overlay using FFmpeg. threads=0 lets FFmpeg decide."""
     if not shutil.which("ffmpeg"):
         return False
     
     try:
+        # A leftover output may be hardlinked into the media pool; replace it
+        # with a new file rather than rewriting that inode in place
+        output_file.unlink(missing_ok=True)
+        
+        # Nothing to draw, so skip the re-encode entirely
+        if is_blank_overlay(overlay_file):
+            # Copy rather than link so temp output never shares an inode with the export
+            shutil.copy2(media_file, output_file)
+            return True
+        
         command = [
-            "ffmpeg", "-y",
+            "ffmpeg", "-y", "-nostdin",
+            "-loglevel", "error",
+            "-threads", str(threads),
             "-i", str(media_file),
             "-i", str(overlay_file),
             "-filter_complex",
@@ -74,29 +220,192 @@ def run_ffmpeg_merge(media_file: Path, overlay_file: Path, output_file: Path) ->
             "-preset", "veryfast",
             "-crf", "18",
             "-c:a", "copy",
+            "-threads", str(threads),
             str(output_file)
         ]
-        result = subprocess.run(command, capture_output=True, text=True, timeout=300)
+        # Only stderr is kept (bytes, decoded on failure only); -loglevel error keeps it small
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=300)
         
         if result.returncode == 0:
             # Preserve timestamps
             st = media_file.stat()
             os.utime(output_file, (st.st_atime, st.st_mtime))
             return True
+        
+        stderr_tail = result.stderr[-FFMPEG_STDERR_TAIL:].decode('utf-8', errors='replace').strip()
+        logger.error(f"FFmpeg failed for {media_file.name} (exit {result.returncode}): {stderr_tail}")
     except Exception as e:
         logger.error(f"FFmpeg error for {media_file.name}: {e}")
     return False
 
+HASH_CHUNK_SIZE = 1 << 20
+# Hashes are only compared for equality, so 128-bit digests suffice
+HASH_DIGEST_SIZE = 16
+HASH_ALGO = "blake3" if blake3 else "blake2b"
+
+def _new_blake2b():
+    return hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+
 def calculate_file_hash(file_path: Path) -> Optional[str]:
-    """Calculate MD5 hash of file."""
+    """Calculate a 128-bit BLAKE3 (or BLAKE2b) hash of a file."""
+    try:
+        if blake3:
+            h = blake3.blake3(max_threads=blake3.blake3.AUTO)
+            h.update_mmap(file_path)
+            return h.hexdigest(HASH_DIGEST_SIZE)
+        
+        with open(file_path, 'rb', buffering=0) as f:
+            if hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(f, _new_blake2b).hexdigest()
+            
+            h = _new_blake2b()
+            buf = bytearray(HASH_CHUNK_SIZE)
+            view = memoryview(buf)
+            while n := f.readinto(buf):
+                h.update(view[:n])
+            return h.hexdigest()
+    except Exception:
+        return None
+
+class HashCache:
+    """Persistent file hash cache keyed by (algorithm, name, size, mtime_ns)."""
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries = load_json(path) if path.exists() else {}
+        self.dirty = False
+        # Save even if the run is interrupted
+        atexit.register(self.save)
+    
+    @staticmethod
+    def _key(file_path: Path) -> str:
+        st = file_path.stat()
+        return f"{HASH_ALGO}|{file_path.name}|{st.st_size}|{st.st_mtime_ns}"
+    
+    def hash(self, file_path: Path) -> Optional[str]:
+        """Return the cached hash, computing and storing it on a miss."""
+        try:
+            key = self._key(file_path)
+        except OSError:
+            return None
+        
+        file_hash = self.entries.get(key)
+        if file_hash is None:
+            file_hash = calculate_file_hash(file_path)
+            if file_hash:
+                self.entries[key] = file_hash
+                self.dirty = True
+        return file_hash
+    
+    def save(self) -> None:
+        """Write the cache if anything changed."""
+        if self.dirty:
+            save_json(self.entries, self.path)
+            self.dirty = False
+
+FINGERPRINT_SIZE = 65536
+HASH_WORKERS = 8
+
+def _cheap_fingerprint(file_path: Path) -> Optional[bytes]:
+    """Size plus the first 64 KiB; identifies small files exactly."""
     try:
         with open(file_path, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
+            return struct.pack('>Q', os.fstat(f.fileno()).st_size) + f.read(FINGERPRINT_SIZE)
     except Exception:
         return None
 
-def merge_overlay_pairs(source_dir: Path, temp_dir: Path) -> Tuple[Set[str], Dict[str, Any]]:
-    """Find and merge media/overlay pairs. Returns merged files and statistics."""
+def _hash_many(paths: List[Path], hash_func=calculate_file_hash) -> List[Any]:
+    """Apply a file hashing function to several paths concurrently, keeping order."""
+    if len(paths) <= 1:
+        return [hash_func(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=min(HASH_WORKERS, len(paths))) as executor:
+        return list(executor.map(hash_func, paths))
+
+def overlay_content_keys(files: List[Path], hash_cache: Optional[HashCache] = None) -> List[Optional[bytes]]:
+    """Keys that are equal exactly when file contents are equal (None on read errors).
+    
+    Only files sharing a fingerprint and larger than it are fully hashed.
+    """
+    fingerprints = _hash_many(files, _cheap_fingerprint)
+    counts = defaultdict(int)
+    for fp in fingerprints:
+        if fp:
+            counts[fp] += 1
+    
+    # Same size and head; the tail decides
+    ambiguous = [
+        i for i, fp in enumerate(fingerprints)
+        if fp and counts[fp] > 1 and struct.unpack_from('>Q', fp)[0] > FINGERPRINT_SIZE
+    ]
+    hash_func = hash_cache.hash if hash_cache else calculate_file_hash
+    full_hashes = dict(zip(ambiguous, _hash_many([files[i] for i in ambiguous], hash_func)))
+    
+    keys = []
+    for i, fp in enumerate(fingerprints):
+        if i in full_hashes:
+            keys.append(fp + full_hashes[i].encode() if full_hashes[i] else None)
+        else:
+            keys.append(fp)
+    return keys
+
+def _process_date_group(date_str: str, media_files: List[Path], overlay_files: List[Path],
+                        temp_dir: Path, threads: int = 0,
+                        hash_cache: Optional[HashCache] = None) -> Tuple[Set[str], Dict[str, Any]]:
+    """Merge one date's media/overlay files. Returns merged files and statistics."""
+    merged_files = set()
+    stats = defaultdict(int)
+    stats['ffmpeg_errors'] = []
+    
+    # Simple pair
+    if len(media_files) == 1 and len(overlay_files) == 1:
+        stats['simple_pairs_attempted'] += 1
+        output_file = temp_dir / media_files[0].name
+        if run_ffmpeg_merge(media_files[0], overlay_files[0], output_file, threads):
+            merged_files.add(media_files[0].name)
+            merged_files.add(overlay_files[0].name)
+            stats['simple_pairs_succeeded'] += 1
+            stats['total_merged'] += 1
+        else:
+            stats['ffmpeg_errors'].append(media_files[0].name)
+    
+    # Multi-part with identical overlays
+    elif len(overlay_files) > 1 and len(media_files) == len(overlay_files):
+        # Check if overlays identical
+        keys = overlay_content_keys(overlay_files, hash_cache)
+        if len(set(k for k in keys if k)) == 1:
+            stats['multipart_attempted'] += 1
+            folder_name, folder_stats = process_multipart(date_str, media_files, overlay_files[0], temp_dir)
+            if folder_name:
+                for f in media_files + overlay_files:
+                    merged_files.add(f.name)
+                stats['multipart_succeeded'] += 1
+                stats['total_merged'] += folder_stats['successful']
+        else:
+            # Process groups with different overlays
+            stats['grouped_attempted'] += 1
+            result, group_stats = process_grouped_overlays(date_str, media_files, overlay_files, temp_dir, hash_cache)
+            merged_files.update(result)
+            if group_stats['successful'] > 0:
+                stats['grouped_succeeded'] += 1
+                stats['total_merged'] += group_stats['successful']
+    
+    # Mismatched counts - try grouping
+    elif len(overlay_files) > 1 and len(media_files) > 1:
+        stats['grouped_attempted'] += 1
+        result, group_stats = process_grouped_overlays(date_str, media_files, overlay_files, temp_dir, hash_cache)
+        merged_files.update(result)
+        if group_stats['successful'] > 0:
+            stats['grouped_succeeded'] += 1
+            stats['total_merged'] += group_stats['successful']
+    
+    return merged_files, stats
+
+def merge_overlay_pairs(source_dir: Path, temp_dir: Path,
+                        hash_cache_path: Optional[Path] = None) -> Tuple[Set[str], Dict[str, Any]]:
+    """Find and merge media/overlay pairs. Returns merged files and statistics.
+    
+    hash_cache_path, if given, persists overlay hashes between runs.
+    """
     logger.info("=" * 60)
     logger.info("Starting OVERLAY MERGING phase")
     logger.info("=" * 60)
@@ -122,77 +431,64 @@ def merge_overlay_pairs(source_dir: Path, temp_dir: Path) -> Tuple[Set[str], Dic
     
     # Group files by date
     files_by_date = defaultdict(lambda: {"media": [], "overlay": []})
-    for file_path in source_dir.iterdir():
-        if not file_path.is_file():
-            continue
-        
-        match = re.match(r"(\d{4}-\d{2}-\d{2})", file_path.name)
-        if not match:
-            continue
-        
-        date_str = match.group(1)
-        name_lower = file_path.name.lower()
-        
-        # Skip thumbnails and stubs
-        if "thumbnail" in name_lower or "media~zip-" in file_path.name:
-            continue
-        
-        if "_media~" in file_path.name:
-            files_by_date[date_str]["media"].append(file_path)
-            stats['total_media'] += 1
-        elif "_overlay~" in file_path.name:
-            files_by_date[date_str]["overlay"].append(file_path)
-            stats['total_overlay'] += 1
+    with os.scandir(source_dir) as entries:
+        for entry in entries:
+            # DirEntry caches the file type from the directory read
+            if not entry.is_file():
+                continue
+            
+            # One match yields the date and kind; thumbnails and stubs are skipped
+            match = _CLASSIFY_RE.match(entry.name)
+            if not match:
+                continue
+            
+            if match['media']:
+                files_by_date[match['date']]["media"].append(Path(entry.path))
+                stats['total_media'] += 1
+            else:
+                files_by_date[match['date']]["overlay"].append(Path(entry.path))
+                stats['total_overlay'] += 1
     
     logger.info(f"Found {stats['total_media']} media files and {stats['total_overlay']} overlay files")
     
     merged_files = set()
     
+    # Simple pairs are a single FFmpeg subprocess each, so run them on threads.
+    # Multipart/grouped dates run their own process pools and stay on this
+    # thread so those pools are never forked from a multithreaded process.
+    simple_dates = []
+    pooled_dates = []
     for date_str, files in files_by_date.items():
-        media_files = files["media"]
-        overlay_files = files["overlay"]
-        
-        # Simple pair
-        if len(media_files) == 1 and len(overlay_files) == 1:
-            stats['simple_pairs_attempted'] += 1
-            output_file = temp_dir / media_files[0].name
-            if run_ffmpeg_merge(media_files[0], overlay_files[0], output_file):
-                merged_files.add(media_files[0].name)
-                merged_files.add(overlay_files[0].name)
-                stats['simple_pairs_succeeded'] += 1
-                stats['total_merged'] += 1
-            else:
-                stats['ffmpeg_errors'].append(media_files[0].name)
-        
-        # Multi-part with identical overlays
-        elif len(overlay_files) > 1 and len(media_files) == len(overlay_files):
-            # Check if overlays identical
-            hashes = [calculate_file_hash(f) for f in overlay_files]
-            if len(set(h for h in hashes if h)) == 1:
-                stats['multipart_attempted'] += 1
-                folder_name, folder_stats = process_multipart(date_str, media_files, overlay_files[0], temp_dir)
-                if folder_name:
-                    for f in media_files + overlay_files:
-                        merged_files.add(f.name)
-                    stats['multipart_succeeded'] += 1
-                    stats['total_merged'] += folder_stats['successful']
-            else:
-                # Process groups with different overlays
-                stats['grouped_attempted'] += 1
-                result, group_stats = process_grouped_overlays(date_str, media_files, overlay_files, temp_dir)
-                merged_files.update(result)
-                if group_stats['successful'] > 0:
-                    stats['grouped_succeeded'] += 1
-                    stats['total_merged'] += group_stats['successful']
-        
-        # Mismatched counts - try grouping
-        elif len(overlay_files) > 1 and len(media_files) > 1:
-            stats['grouped_attempted'] += 1
-            result, group_stats = process_grouped_overlays(date_str, media_files, overlay_files, temp_dir)
-            merged_files.update(result)
-            if group_stats['successful'] > 0:
-                stats['grouped_succeeded'] += 1
-                stats['total_merged'] += group_stats['successful']
+        if len(files["media"]) == 1 and len(files["overlay"]) == 1:
+            simple_dates.append(date_str)
+        else:
+            pooled_dates.append(date_str)
+    
+    def add_group_result(group_result: Tuple[Set[str], Dict[str, Any]]) -> None:
+        group_merged, group_stats = group_result
+        merged_files.update(group_merged)
+        for key, value in group_stats.items():
+            stats[key] += value
+    
+    if simple_dates:
+        # Cap each FFmpeg so concurrent merges don't oversubscribe the cores
+        threads = get_ffmpeg_threads(MERGE_WORKERS)
+        with ThreadPoolExecutor(max_workers=MERGE_WORKERS) as executor:
+            futures = [
+                executor.submit(_process_date_group, date_str, files_by_date[date_str]["media"],
+                                files_by_date[date_str]["overlay"], temp_dir, threads)
+                for date_str in simple_dates
+            ]
+            for future in as_completed(futures):
+                add_group_result(future.result())
+    
+    hash_cache = HashCache(hash_cache_path) if hash_cache_path else None
+    for date_str in pooled_dates:
+        add_group_result(_process_date_group(date_str, files_by_date[date_str]["media"],
+                                             files_by_date[date_str]["overlay"], temp_dir,
+                                             hash_cache=hash_cache))
+    if hash_cache:
+        hash_cache.save()
     
     # Log statistics
     logger.info("=" * 60)
@@ -230,8 +526,10 @@ def process_multipart(date_str: str, media_files: List[Path], overlay_file: Path
     try:
         ensure_directory(folder_path)
         
+        num_processes = max(1, cpu_count() - 1)
+        threads = get_ffmpeg_threads(num_processes)
         tasks = [
-            (media_file, overlay_file, folder_path / media_file.name)
+            (str(media_file), str(overlay_file), str(folder_path / media_file.name), threads)
             for media_file in media_files_sorted
         ]
         
@@ -239,25 +537,23 @@ def process_multipart(date_str: str, media_files: List[Path], overlay_file: Path
         
         timestamps = {}
         
-        num_processes = max(1, cpu_count() - 1)
-        with Pool(processes=num_processes) as pool:
-            results = pool.map(_ffmpeg_worker, tasks)
-
-        for result in results:
-            if result:
-                stats['successful'] += 1
-                filename, timestamp = result
-                if timestamp:
-                    timestamps[filename] = timestamp  # Already in ISO format
-            else:
-                stats['failed'] += 1
+        with _MP_CONTEXT.Pool(processes=num_processes) as pool:
+            # Consume merges as they finish rather than waiting for the whole batch
+            for done, result in enumerate(pool.imap_unordered(_ffmpeg_worker, tasks, chunksize=FFMPEG_CHUNKSIZE), 1):
+                if result:
+                    stats['successful'] += 1
+                    filename, timestamp = result
+                    if timestamp:
+                        timestamps[filename] = timestamp  # Already in ISO format
+                else:
+                    stats['failed'] += 1
+                logger.debug(f"    {done}/{len(tasks)} merges finished - {folder_name}")
         
         success_pct = (stats['successful'] / stats['attempted']) * 100 if stats['attempted'] > 0 else 0
         logger.info(f"  Multipart merging: [{stats['successful']}]/[{stats['attempted']}] ({success_pct:.1f}%) - {folder_name}")
         
         if stats['successful'] > 0:
-            with open(folder_path / "timestamps.json", 'w', encoding='utf-8') as f:
-                json.dump(timestamps, f, indent=2)
+            write_timestamps_json(timestamps, folder_path / "timestamps.json")
             return folder_name, stats
         else:
             logger.warning(f"  All merges failed for multipart {folder_name}")
@@ -271,24 +567,23 @@ def process_multipart(date_str: str, media_files: List[Path], overlay_file: Path
     
     return None, stats
 
-def process_grouped_overlays(date_str: str, media_files: List[Path], overlay_files: List[Path], temp_dir: Path) -> Tuple[Set[str], Dict[str, int]]:
+def process_grouped_overlays(date_str: str, media_files: List[Path], overlay_files: List[Path], temp_dir: Path,
+                             hash_cache: Optional[HashCache] = None) -> Tuple[Set[str], Dict[str, int]]:
     """Process groups of overlays and media files. Returns merged files and statistics."""
     merged = set()
     stats = {'attempted': 0, 'successful': 0, 'failed': 0}
     
-    # Group overlays by hash
+    # Group overlays by content
     overlay_groups = defaultdict(list)
-    for overlay in overlay_files:
-        file_hash = calculate_file_hash(overlay)
-        if file_hash:
-            overlay_groups[file_hash].append(overlay)
-    
-    # Group media by timestamp
-    media_with_ts = []
-    for media in media_files:
-        ts = extract_mp4_timestamp(media)
-        if ts:
-            media_with_ts.append((media, ts))
+    for overlay, key in zip(overlay_files, overlay_content_keys(overlay_files, hash_cache)):
+        if key:
+            overlay_groups[key].append(overlay)
+    
+    # Group media by timestamp; header reads are I/O-bound so overlap them
+    with ThreadPoolExecutor(max_workers=min(IO_WORKERS, len(media_files) or 1)) as executor:
+        media_ts = list(executor.map(extract_mp4_timestamp, media_files))
+    # Convert once to milliseconds instead of re-parsing ISO strings per comparison
+    media_with_ts = [(media, iso_to_ms(ts)) for media, ts in zip(media_files, media_ts) if ts]
     
     media_with_ts.sort(key=lambda x: x[1])
     media_groups = []
@@ -298,7 +593,7 @@ def process_grouped_overlays(date_str: str, media_files: List[Path], overlay_fil
         current_ts = media_with_ts[0][1]
         
         for media, ts in media_with_ts[1:]:
-            if get_timestamp_diff_seconds(ts, current_ts) <= TIMESTAMP_THRESHOLD_SECONDS:
+            if abs(ts - current_ts) <= TIMESTAMP_THRESHOLD_SECONDS * 1000:
                 current_group.append(media)
             else:
                 media_groups.append(current_group)
@@ -310,34 +605,35 @@ def process_grouped_overlays(date_str: str, media_files: List[Path], overlay_fil
     
     logger.info(f"Processing grouped overlays: {len(media_groups)} media groups, {len(overlay_groups)} overlay groups")
     
-    # Match groups by count
-    overlay_list = list(overlay_groups.values())
+    # Match groups by count; each size bucket hands out groups in original order
+    overlays_by_len = defaultdict(deque)
+    for overlay_group in overlay_groups.values():
+        overlays_by_len[len(overlay_group)].append(overlay_group)
     
     for media_group in media_groups:
-        for i, overlay_group in enumerate(overlay_list):
-            if len(media_group) == len(overlay_group):
-                stats['attempted'] += len(media_group)
-                
-                if len(media_group) == 1:
-                    # Single pair
-                    output = temp_dir / media_group[0].name
-                    if run_ffmpeg_merge(media_group[0], overlay_group[0], output):
-                        merged.add(media_group[0].name)
-                        merged.add(overlay_group[0].name)
-                        stats['successful'] += 1
-                    else:
-                        stats['failed'] += 1
-                else:
-                    # Multi-file group
-                    folder_name, folder_stats = create_grouped_folder(media_group, overlay_group, temp_dir)
-                    if folder_name:
-                        for f in media_group + overlay_group:
-                            merged.add(f.name)
-                        stats['successful'] += folder_stats['successful']
-                        stats['failed'] += folder_stats['failed']
-                
-                overlay_list.pop(i)
-                break
+        candidates = overlays_by_len.get(len(media_group))
+        if not candidates:
+            continue
+        overlay_group = candidates.popleft()
+        stats['attempted'] += len(media_group)
+        
+        if len(media_group) == 1:
+            # Single pair
+            output = temp_dir / media_group[0].name
+            if run_ffmpeg_merge(media_group[0], overlay_group[0], output, get_ffmpeg_threads(1)):
+                merged.add(media_group[0].name)
+                merged.add(overlay_group[0].name)
+                stats['successful'] += 1
+            else:
+                stats['failed'] += 1
+        else:
+            # Multi-file group
+            folder_name, folder_stats = create_grouped_folder(media_group, overlay_group, temp_dir)
+            if folder_name:
+                for f in media_group + overlay_group:
+                    merged.add(f.name)
+                stats['successful'] += folder_stats['successful']
+                stats['failed'] += folder_stats['failed']
     
     if stats['attempted'] > 0:
         success_pct = (stats['successful'] / stats['attempted']) * 100
@@ -358,8 +654,10 @@ def create_grouped_folder(media_files: List[Path], overlay_files: List[Path], te
     try:
         ensure_directory(folder_path)
 
+        num_processes = max(1, cpu_count() - 1)
+        threads = get_ffmpeg_threads(num_processes)
         tasks = [
-            (media, overlay, folder_path / media.name)
+            (str(media), str(overlay), str(folder_path / media.name), threads)
             for media, overlay in zip(media_sorted, overlay_sorted)
         ]
 
@@ -367,25 +665,23 @@ def create_grouped_folder(media_files: List[Path], overlay_files: List[Path], te
 
         timestamps = {}
         
-        num_processes = max(1, cpu_count() - 1)
-        with Pool(processes=num_processes) as pool:
-            results = pool.map(_ffmpeg_worker, tasks)
-
-        for result in results:
-            if result:
-                stats['successful'] += 1
-                filename, timestamp = result
-                if timestamp:
-                    timestamps[filename] = timestamp  # Already in ISO format
-            else:
-                stats['failed'] += 1
+        with _MP_CONTEXT.Pool(processes=num_processes) as pool:
+            # Consume merges as they finish rather than waiting for the whole batch
+            for done, result in enumerate(pool.imap_unordered(_ffmpeg_worker, tasks, chunksize=FFMPEG_CHUNKSIZE), 1):
+                if result:
+                    stats['successful'] += 1
+                    filename, timestamp = result
+                    if timestamp:
+                        timestamps[filename] = timestamp  # Already in ISO format
+                else:
+                    stats['failed'] += 1
+                logger.debug(f"    {done}/{len(tasks)} merges finished - {folder_name}")
         
         success_pct = (stats['successful'] / stats['attempted']) * 100 if stats['attempted'] > 0 else 0
         logger.info(f"  Grouped merging: [{stats['successful']}]/[{stats['attempted']}] ({success_pct:.1f}%) - {folder_name}")
         
         if stats['successful'] > 0:
-            with open(folder_path / "timestamps.json", 'w', encoding='utf-8') as f:
-                json.dump(timestamps, f, indent=2)
+            write_timestamps_json(timestamps, folder_path / "timestamps.json")
             return folder_name, stats
         else:
             logger.warning(f"  All merges failed for grouped {folder_name}")
@@ -401,19 +697,20 @@ def create_grouped_folder(media_files: List[Path], overlay_files: List[Path], te
 
 def extract_media_id(filename: str) -> Optional[str]:
     """Extract media ID from filename."""
-    if 'thumbnail' in filename.lower():
+    # Every ID form contains '~'; most non-media files bail out here
+    if '~' not in filename or _THUMBNAIL_RE.search(filename):
         return None
     
     if 'b~' in filename:
-        match = re.search(r'b~([^.]+)', filename, re.I)
+        match = _B_RE.search(filename)
         if match:
             return f'b~{match.group(1)}'
     
-    match = re.search(r'media~zip-([A-F0-9\-]+)', filename, re.I)
+    match = _ZIP_RE.search(filename)
     if match:
         return f'media~zip-{match.group(1)}'
     
-    match = re.search(r'(media|overlay)~([A-F0-9\-]+)', filename, re.I)
+    match = _MO_RE.search(filename)
     if match:
         return f'{match.group(1)}~{match.group(2)}'
     
@@ -439,33 +736,37 @@ def index_media_files(media_dir: Path) -> Tuple[Dict[str, str], Dict[str, int]]:
         logger.warning(f"Media directory {media_dir} does not exist")
         return {}, stats
     
-    for item in media_dir.iterdir():
-        if item.is_file():
-            stats['total_files'] += 1
-            stats['regular_files'] += 1
-            media_id = extract_media_id(item.name)
-            if media_id:
-                media_index[media_id] = item.name
-                stats['extracted_ids'] += 1
-            else:
-                stats['no_id_files'].append(item.name)
-                
-        elif item.is_dir() and (item.name.endswith("_multipart") or item.name.endswith("_grouped")):
-            if item.name.endswith("_multipart"):
-                stats['multipart_folders'] += 1
-            else:
-                stats['grouped_folders'] += 1
-                
-            # Index files in folder
-            for file_path in item.iterdir():
-                if file_path.suffix.lower() == '.mp4':
-                    stats['total_files'] += 1
-                    media_id = extract_media_id(file_path.name)
-                    if media_id:
-                        media_index[media_id] = item.name  # Map to folder
-                        stats['extracted_ids'] += 1
-                    else:
-                        stats['no_id_files'].append(file_path.name)
+    with os.scandir(media_dir) as entries:
+        for item in entries:
+            name = item.name
+            if item.is_file():
+                stats['total_files'] += 1
+                stats['regular_files'] += 1
+                media_id = extract_media_id(name)
+                if media_id:
+                    media_index[media_id] = name
+                    stats['extracted_ids'] += 1
+                else:
+                    stats['no_id_files'].append(name)
+                    
+            elif item.is_dir() and (name.endswith("_multipart") or name.endswith("_grouped")):
+                if name.endswith("_multipart"):
+                    stats['multipart_folders'] += 1
+                else:
+                    stats['grouped_folders'] += 1
+                    
+                # Index files in folder
+                with os.scandir(item.path) as folder_entries:
+                    for file_entry in folder_entries:
+                        file_name = file_entry.name
+                        if file_name[-4:].lower() == '.mp4':
+                            stats['total_files'] += 1
+                            media_id = extract_media_id(file_name)
+                            if media_id:
+                                media_index[media_id] = name  # Map to folder
+                                stats['extracted_ids'] += 1
+                            else:
+                                stats['no_id_files'].append(file_name)
     
     # Log statistics
     logger.info("MEDIA INDEXING RESULTS:")
@@ -487,40 +788,102 @@ def index_media_files(media_dir: Path) -> Tuple[Dict[str, str], Dict[str, int]]:
     
     return media_index, stats
 
+# Precompiled big-endian layouts used by the atom walker
+_ATOM_HEADER = struct.Struct('>I4s')
+_UINT32 = struct.Struct('>I')
+_UINT64 = struct.Struct('>Q')
+
+def _parse_mvhd(buf: bytes) -> Optional[int]:
+    """Decode creation time from an mvhd atom header: size/type (8), version/flags (4), time."""
+    if len(buf) < 16 or buf[4:8] != b'mvhd':
+        return None
+    if buf[8] == 0:
+        return _UINT32.unpack_from(buf, 12)[0]
+    if len(buf) < 20:
+        return None
+    return _UINT64.unpack_from(buf, 12)[0]
+
+def _find_mvhd_creation_time(mm: mmap.mmap, file_size: int) -> Optional[int]:
+    """Walk top-level atoms to 'moov' and return the raw mvhd creation time.
+    
+    Works directly on the mapping, so only the pages holding atom headers are read.
+    """
+    unpack_header = _ATOM_HEADER.unpack_from
+    unpack_uint64 = _UINT64.unpack_from
+    
+    offset = 0
+    while offset + 8 <= file_size:
+        size, atom_type = unpack_header(mm, offset)
+        
+        if atom_type == b'moov':
+            # mvhd is expected as the first child of moov
+            return _parse_mvhd(mm[offset + 8:offset + 28])
+        
+        if size == 1:
+            if offset + 16 > file_size:
+                return None
+            size = unpack_uint64(mm, offset + 8)[0]
+        if size < 8:
+            return None
+        offset += size
+    
+    return None
+
+@lru_cache(maxsize=8192)
+def _cached_mp4_timestamp(path_str: str, mtime_ns: int, size: int) -> Optional[str]:
+    """Parse one MP4 version; mtime and size in the key invalidate rewritten files."""
+    if size < 8:
+        return None
+    
+    with open(path_str, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        creation_time = _find_mvhd_creation_time(mm, len(mm))
+    
+    if creation_time is None:
+        return None
+    timestamp_ms = (creation_time - QUICKTIME_EPOCH_ADJUSTER) * 1000
+    return format_timestamp(timestamp_ms)
+
 def extract_mp4_timestamp(mp4_path: Path) -> Optional[str]:
     """Extract creation timestamp from MP4 file and return as ISO format string."""
     try:
-        with open(mp4_path, "rb") as f:
-            while True:
-                header = f.read(8)
-                if not header:
-                    return None
-                
-                size = struct.unpack('>I', header[0:4])[0]
-                atom_type = header[4:8]
-                
-                if atom_type == b'moov':
-                    mvhd = f.read(8)
-                    if mvhd[4:8] == b'mvhd':
-                        version = f.read(1)[0]
-                        f.seek(3, 1)
-                        
-                        if version == 0:
-                            creation_time = struct.unpack('>I', f.read(4))[0]
-                        else:
-                            creation_time = struct.unpack('>Q', f.read(8))[0]
-                        
-                        timestamp_ms = (creation_time - QUICKTIME_EPOCH_ADJUSTER) * 1000
-                        return format_timestamp(timestamp_ms)
-                    return None
-                
-                if size == 1:
-                    f.seek(struct.unpack('>Q', f.read(8))[0] - 16, 1)
-                else:
-                    f.seek(size - 8, 1)
+        st = mp4_path.stat()
+        return _cached_mp4_timestamp(str(mp4_path), st.st_mtime_ns, st.st_size)
     except Exception:
         return None
 
+def write_timestamps_json(timestamps: Dict[str, str], path: Path) -> None:
+    """Write a merged folder's timestamps.json (sorted keys, so completion order doesn't matter)."""
+    if orjson:
+        path.write_bytes(orjson.dumps(timestamps, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(timestamps, f, indent=2, sort_keys=True)
+
+def read_folder_timestamp(folder: Path) -> Optional[str]:
+    """Return the earliest ISO timestamp from a merged folder's timestamps.json."""
+    # Open directly rather than exists() + read; a missing file is just None
+    try:
+        fd = os.open(os.path.join(folder, "timestamps.json"), os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    except FileNotFoundError:
+        return None
+    try:
+        raw = os.read(fd, os.fstat(fd).st_size)
+    finally:
+        os.close(fd)
+    
+    data = orjson.loads(raw) if orjson else json.loads(raw)
+    
+    # ISO timestamps sort chronologically as strings
+    return min(data.values()) if data else None
+
+@dataclass(slots=True, frozen=True)
+class MediaMapping:
+    """One media file (or merged folder) mapped to a message."""
+    filename: str
+    mapping_method: str
+    is_grouped: bool
+    time_diff_seconds: Optional[float] = None
+
 def map_media_to_messages(conversations: Dict[str, List], media_index: Dict[str, str], 
                          media_dir: Path) -> Tuple[Dict, Set[str], Dict[str, Any]]:
     """Map media files to conversation messages. Returns mappings, mapped files, and statistics."""
@@ -528,7 +891,7 @@ def map_media_to_messages(conversations: Dict[str, List], media_index: Dict[str,
     logger.info("Starting MEDIA MAPPING phase")
     logger.info("=" * 60)
     
-    mappings = defaultdict(dict)
+    mappings: Dict[str, Dict[int, List]] = defaultdict(lambda: defaultdict(list))
     mapped_files = set()
     
     stats = {
@@ -547,33 +910,37 @@ def map_media_to_messages(conversations: Dict[str, List], media_index: Dict[str,
     # Phase 1: Map by Media ID
     logger.info("Phase 1: Mapping by Media ID...")
     
+    # Plain local counters in the hot loop; copied into stats afterwards
+    messages_with_ids = 0
+    ids_found = 0
+    ids_not_found = 0
+    
     for conv_id, messages in conversations.items():
         for i, msg in enumerate(messages):
-            media_ids_str = msg.get("Media IDs", "")
+            media_ids_str = msg.get("Media IDs")
             if not media_ids_str:
                 continue
             
-            stats['total_messages_with_media_ids'] += 1
+            messages_with_ids += 1
             
             for media_id in media_ids_str.split('|'):
-                media_id = media_id.strip()
-                if media_id in media_index:
-                    filename = media_index[media_id]
-                    is_grouped = filename.endswith("_multipart") or filename.endswith("_grouped")
-                    
-                    if i not in mappings[conv_id]:
-                        mappings[conv_id][i] = []
-                    
-                    mappings[conv_id][i].append({
-                        "filename": filename,
-                        "mapping_method": "media_id",
-                        "is_grouped": is_grouped
-                    })
-                    mapped_files.add(filename)
-                    stats['media_ids_found'] += 1
-                    stats['mapped_by_id'] += 1
-                else:
-                    stats['media_ids_not_found'] += 1
+                filename = media_index.get(media_id.strip())
+                if filename is None:
+                    ids_not_found += 1
+                    continue
+                
+                mappings[conv_id][i].append(MediaMapping(
+                    filename=filename,
+                    mapping_method="media_id",
+                    is_grouped=filename.endswith(("_multipart", "_grouped"))
+                ))
+                mapped_files.add(filename)
+                ids_found += 1
+    
+    stats['total_messages_with_media_ids'] = messages_with_ids
+    stats['media_ids_found'] = ids_found
+    stats['media_ids_not_found'] = ids_not_found
+    stats['mapped_by_id'] = ids_found
     
     if stats['total_messages_with_media_ids'] > 0:
         found_pct = (stats['media_ids_found'] / (stats['media_ids_found'] + stats['media_ids_not_found'])) * 100 if (stats['media_ids_found'] + stats['media_ids_not_found']) > 0 else 0
@@ -585,120 +952,87 @@ def map_media_to_messages(conversations: Dict[str, List], media_index: Dict[str,
     unmapped_mp4s = []
     unmapped_folders = []
     
-    for item in media_dir.iterdir():
-        if item.name not in mapped_files:
-            if item.is_file() and item.suffix.lower() == '.mp4':
-                unmapped_mp4s.append(item)
-            elif item.is_dir() and (item.name.endswith("_multipart") or item.name.endswith("_grouped")):
-                unmapped_folders.append(item)
+    # One scandir pass partitions the directory; DirEntry caches the file type
+    file_names = set()
+    with os.scandir(media_dir) as it:
+        for entry in it:
+            name = entry.name
+            if entry.is_file():
+                file_names.add(name)
+                if name not in mapped_files and name[-4:].lower() == '.mp4':
+                    unmapped_mp4s.append(Path(entry.path))
+            elif (name not in mapped_files and entry.is_dir()
+                    and (name.endswith("_multipart") or name.endswith("_grouped"))):
+                unmapped_folders.append(Path(entry.path))
     
     logger.info(f"  Found {len(unmapped_mp4s)} unmapped MP4 files and {len(unmapped_folders)} unmapped folders")
     
-    # Build message timestamp index with ISO format
+    # Build message timestamp index in milliseconds
     msg_timestamps = []
     for conv_id, messages in conversations.items():
         for i, msg in enumerate(messages):
-            # Try to get ISO timestamp directly or convert from milliseconds
-            iso_ts = None
+            msg_ts = None
             if msg.get("Created"):
                 # Parse "Created" field if it exists (format: "2025-07-18 15:38:47 UTC")
-                created_str = msg["Created"]
-                if created_str.endswith(" UTC"):
-                    created_str = created_str[:-4]
-                try:
-                    dt = datetime.strptime(created_str, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
-                    iso_ts = dt.isoformat().replace('+00:00', 'Z')
-                except:
-                    pass
+                msg_ts = parse_created(msg["Created"])
             
-            if not iso_ts:
+            if not msg_ts:
                 # Fall back to milliseconds field
                 ts_ms = int(msg.get("Created(microseconds)", 0))
                 if ts_ms > 0:
-                    iso_ts = format_timestamp(ts_ms)
+                    msg_ts = ts_ms
             
-            if iso_ts:
-                msg_timestamps.append((conv_id, i, iso_ts))
+            if msg_ts:
+                msg_timestamps.append((conv_id, i, msg_ts))
     
-    # Sort by ISO timestamp (string sorting works for ISO format)
+    # Sort once so each lookup is a binary search
     msg_timestamps.sort(key=lambda x: x[2])
+    msg_ts_values = [ts for _, _, ts in msg_timestamps]
+    threshold_ms = TIMESTAMP_THRESHOLD_SECONDS * 1000
+    
+    # Header and sidecar reads are pure I/O, so overlap them across threads
+    with ThreadPoolExecutor(max_workers=IO_WORKERS) as executor:
+        mp4_timestamps = list(executor.map(extract_mp4_timestamp, unmapped_mp4s))
+        folder_timestamps = list(executor.map(read_folder_timestamp, unmapped_folders))
     
     # Map MP4s by timestamp
-    for mp4_file in unmapped_mp4s:
-        iso_timestamp = extract_mp4_timestamp(mp4_file)
-        if iso_timestamp:
-            stats['mp4s_with_timestamp'] += 1
-            best_match = None
-            min_diff_seconds = float('inf')
-            
-            for conv_id, msg_idx, msg_iso_ts in msg_timestamps:
-                diff_seconds = get_timestamp_diff_seconds(iso_timestamp, msg_iso_ts)
-                if diff_seconds < min_diff_seconds:
-                    min_diff_seconds = diff_seconds
-                    best_match = (conv_id, msg_idx)
-            
-            if best_match and min_diff_seconds <= TIMESTAMP_THRESHOLD_SECONDS:
-                conv_id, msg_idx = best_match
-                if msg_idx not in mappings[conv_id]:
-                    mappings[conv_id][msg_idx] = []
-                
-                mappings[conv_id][msg_idx].append({
-                    "filename": mp4_file.name,
-                    "mapping_method": "timestamp",
-                    "time_diff_seconds": round(min_diff_seconds, 1),
-                    "is_grouped": False
-                })
-                mapped_files.add(mp4_file.name)
-                stats['mapped_by_timestamp'] += 1
-                stats['timestamp_matches'] += 1
-        else:
-            stats['mp4s_without_timestamp'] += 1
+    mp4_targets = [(mp4_file, iso_to_ms(ts)) for mp4_file, ts in zip(unmapped_mp4s, mp4_timestamps) if ts]
+    stats['mp4s_with_timestamp'] = len(mp4_targets)
+    stats['mp4s_without_timestamp'] = len(unmapped_mp4s) - len(mp4_targets)
+    mp4_matches = find_nearest_timestamps(msg_ts_values, [ts for _, ts in mp4_targets], threshold_ms)
+    
+    for (mp4_file, _), (best_idx, min_diff_seconds) in zip(mp4_targets, mp4_matches):
+        if best_idx >= 0:
+            conv_id, msg_idx, _ = msg_timestamps[best_idx]
+            mappings[conv_id][msg_idx].append(MediaMapping(
+                filename=mp4_file.name,
+                mapping_method="timestamp",
+                is_grouped=False,
+                time_diff_seconds=round(min_diff_seconds, 1)
+            ))
+            mapped_files.add(mp4_file.name)
+            stats['mapped_by_timestamp'] += 1
+            stats['timestamp_matches'] += 1
     
     # Map folders by timestamp
-    for folder in unmapped_folders:
-        timestamps_file = folder / "timestamps.json"
-        min_iso_timestamp = None
-        
-        if timestamps_file.exists():
-            with open(timestamps_file) as f:
-                data = json.load(f)
-                # Find the earliest ISO timestamp in the folder
-                iso_timestamps = list(data.values())
-                if iso_timestamps:
-                    # Sort ISO timestamps and take the earliest
-                    iso_timestamps.sort()
-                    min_iso_timestamp = iso_timestamps[0]
-        
-        if min_iso_timestamp:
-            best_match = None
-            min_diff_seconds = float('inf')
-            
-            for conv_id, msg_idx, msg_iso_ts in msg_timestamps:
-                diff_seconds = get_timestamp_diff_seconds(min_iso_timestamp, msg_iso_ts)
-                if diff_seconds < min_diff_seconds:
-                    min_diff_seconds = diff_seconds
-                    best_match = (conv_id, msg_idx)
-            
-            if best_match and min_diff_seconds <= TIMESTAMP_THRESHOLD_SECONDS:
-                conv_id, msg_idx = best_match
-                if msg_idx not in mappings[conv_id]:
-                    mappings[conv_id][msg_idx] = []
-                
-                mappings[conv_id][msg_idx].append({
-                    "filename": folder.name,
-                    "mapping_method": "timestamp",
-                    "time_diff_seconds": round(min_diff_seconds, 1),
-                    "is_grouped": True
-                })
-                mapped_files.add(folder.name)
-                stats['folders_mapped'] += 1
-                stats['mapped_by_timestamp'] += 1
+    folder_targets = [(folder, iso_to_ms(ts)) for folder, ts in zip(unmapped_folders, folder_timestamps) if ts]
+    folder_matches = find_nearest_timestamps(msg_ts_values, [ts for _, ts in folder_targets], threshold_ms)
+    
+    for (folder, _), (best_idx, min_diff_seconds) in zip(folder_targets, folder_matches):
+        if best_idx >= 0:
+            conv_id, msg_idx, _ = msg_timestamps[best_idx]
+            mappings[conv_id][msg_idx].append(MediaMapping(
+                filename=folder.name,
+                mapping_method="timestamp",
+                is_grouped=True,
+                time_diff_seconds=round(min_diff_seconds, 1)
+            ))
+            mapped_files.add(folder.name)
+            stats['folders_mapped'] += 1
+            stats['mapped_by_timestamp'] += 1
     
     # Calculate unmapped
-    all_media_count = len(unmapped_mp4s) + len(unmapped_folders)
-    for item in media_dir.iterdir():
-        if item.is_file() and item.name in mapped_files:
-            all_media_count += 1
+    all_media_count = len(unmapped_mp4s) + len(unmapped_folders) + len(file_names & mapped_files)
     
     stats['unmapped_files'] = all_media_count - len(mapped_files) if all_media_count > len(mapped_files) else 0
     